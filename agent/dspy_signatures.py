@@ -1,6 +1,25 @@
+import os
+import re
 import dspy
 from typing import Literal
 
+# Compiled modules written by optimize_nl_to_sql.py
+NL_TO_SQL_ARTIFACT = "artifacts/nl_to_sql_optimized.json"
+SQL_REPAIR_ARTIFACT = "artifacts/sql_repair_optimized.json"
+
+# Local Ollama model used by every entry point (batch, interactive, optimizer)
+OLLAMA_MODEL = "ollama_chat/phi3.5:3.8b-mini-instruct-q4_K_M"
+OLLAMA_API_BASE = "http://localhost:11434"
+
+# Aggregation phrasing always needs the database, so these questions skip the router LLM
+# and go to "hybrid" (SQL plus doc context; "sql" would drop docs the question may rely on).
+# Questions that point at the docs (policies, definitions, formulas, the marketing calendar)
+# are left to the LLM: "how many days..." there may be a pure doc lookup.
+_SQL_CUE_RE = re.compile(r"\b(how many|total|sum|average|avg|count|top \d+|revenue|highest|lowest)\b", re.I)
+_DOC_ONLY_CUE_RE = re.compile(
+    r"\b(polic(y|ies)|return window|defin\w*|formula|according to|docs?|calendar)\b", re.I
+)
+
 class RouterSignature(dspy.Signature):
     """Classify the question into rag, sql, or hybrid based on what information is needed."""
     question = dspy.InputField(desc="The user's question")
@@ -8,33 +27,37 @@ class RouterSignature(dspy.Signature):
 
 class NLToSQLSignature(dspy.Signature):
     """Generate SQLite query from natural language question and schema."""
-    question = dspy.InputField(desc="The question to answer")
+    # Invariant fields first so the rendered prompt prefix is shared across questions
     schema = dspy.InputField(desc="Database schema")
+    question = dspy.InputField(desc="The question to answer")
     context = dspy.InputField(desc="Additional context from documents", default="")
     sql = dspy.OutputField(desc="Valid SQLite query")
 
 class SQLRepairSignature(dspy.Signature):
     """Fix SQL query based on error message."""
+    schema = dspy.InputField(desc="Database schema")
     original_sql = dspy.InputField(desc="The SQL that failed")
     error = dspy.InputField(desc="Error message")
-    schema = dspy.InputField(desc="Database schema")
     fixed_sql = dspy.OutputField(desc="Corrected SQLite query")
 
 class SynthesizerSignature(dspy.Signature):
     """Synthesize final answer from retrieved docs and SQL results."""
-    question = dspy.InputField(desc="Original question")
     format_hint = dspy.InputField(desc="Expected output format")
+    question = dspy.InputField(desc="Original question")
     doc_context = dspy.InputField(desc="Retrieved document chunks", default="")
-    sql_results = dspy.InputField(desc="SQL query results", default="")
+    sql_results = dspy.InputField(desc="SQL query results as CSV (header row first)", default="")
     answer = dspy.OutputField(desc="Final answer matching format_hint")
     explanation = dspy.OutputField(desc="Brief explanation (1-2 sentences)")
 
 class Router(dspy.Module):
     def __init__(self):
         super().__init__()
-        self.classify = dspy.ChainOfThought(RouterSignature)
+        self.classify = dspy.Predict(RouterSignature, temperature=0.0)
     
     def forward(self, question: str) -> str:
+        if _SQL_CUE_RE.search(question) and not _DOC_ONLY_CUE_RE.search(question):
+            return 'hybrid'
+        
         result = self.classify(question=question)
         route = result.route.lower().strip()
         
@@ -97,4 +120,24 @@ class Synthesizer(dspy.Module):
             doc_context=doc_context,
             sql_results=sql_results
         )
-        return result.answer.strip(), result.explanation.strip()
\ No newline at end of file
+        return result.answer.strip(), result.explanation.strip()
+
+def load_optimized(module: dspy.Module, path: str) -> dspy.Module:
+    """Load saved few-shot demos into module if the artifact exists; otherwise keep the baseline."""
+    if os.path.exists(path):
+        module.load(path)
+    return module
+
+def configure_lm(max_tokens: int = 300, temperature: float = 0.0) -> dspy.LM:
+    """Configure DSPy with the local Ollama model so compiled demos and live runs share one endpoint."""
+    lm = dspy.LM(
+        # ollama_chat sends keep_alive top-level, where Ollama honors it
+        # (the ollama/ provider buries it in "options", where it is ignored)
+        model=OLLAMA_MODEL,
+        api_base=OLLAMA_API_BASE,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        keep_alive='30m'  # keep the model resident between questions
+    )
+    dspy.configure(lm=lm)
+    return lm
\ No newline at end of file
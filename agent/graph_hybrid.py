@@ -1,14 +1,49 @@
+import csv
+import hashlib
+import io
+import inspect
 import json
+import operator
+import os
 import re
-from typing import Dict, Any, List, TypedDict, Annotated
-from langgraph.graph import StateGraph, END
-from agent.dspy_signatures import Router, NLToSQL, SQLRepair, Synthesizer
+from typing import Dict, Any, List, Optional, TypedDict, Annotated
+import dspy
+import numpy as np
+from langgraph.graph import StateGraph, START, END
+import agent.dspy_signatures
+from agent.dspy_signatures import (Router, NLToSQL, SQLRepair, Synthesizer, load_optimized,
+                                   NL_TO_SQL_ARTIFACT, SQL_REPAIR_ARTIFACT)
 from agent.rag.retrieval import Retriever
+from agent.semantic_cache import SemanticCache
 from agent.tools.sqlite_tool import SQLiteTool
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+_DATE_RE = re.compile(r'\d{4}-\d{2}-\d{2}')
+_INT_RE = re.compile(r'\d+')
+_FLOAT_RE = re.compile(r'[\d.]+')
+
+# Results below this confidence (or with failed SQL) are not cached
+_CACHE_MIN_CONFIDENCE = 0.5
+
+# Tables cited when they appear in executed SQL
+_CITABLE_TABLES = ["Orders", "Order Details", "Products", "Customers", "Categories", "Suppliers"]
+
+def _parse_int(answer: str) -> int:
+    return int(_INT_RE.search(answer).group())
+
+def _parse_float(answer: str) -> float:
+    match = _FLOAT_RE.search(answer)
+    return round(float(match.group()), 2) if match else 0.0
+
 class AgentState(TypedDict):
     question: str
     format_hint: str
+    precomputed_qvec: Optional[np.ndarray]
     route: str
     retrieved_docs: List[Dict]
     sql: str
@@ -18,20 +53,37 @@ class AgentState(TypedDict):
     citations: List[str]
     confidence: float
     repair_count: int
-    trace: List[str]
+    # Accumulator: nodes return only their new trace lines and LangGraph appends them.
+    # Every other key keeps the default last-value channel (nodes return partial updates).
+    trace: Annotated[List[str], operator.add]
 
 class HybridAgent:
-    def __init__(self, db_path: str, docs_path: str):
+    def __init__(self, db_path: str, docs_path: str, use_cache: bool = True,
+                 cache_path: Optional[str] = None, index_path: Optional[str] = None):
         self.db_tool = SQLiteTool(db_path)
-        self.retriever = Retriever(docs_path)
+        self.retriever = Retriever(docs_path, index_path=index_path)
         self.schema = self.db_tool.get_schema()
         
+        # Semantic response cache keyed on question embeddings
+        self.db_path = db_path
+        self.cache = SemanticCache(
+            self.retriever.encode_query, path=cache_path, version=self._cache_version()
+        ) if use_cache else None
+        
         # DSPy modules
         self.router = Router()
-        self.nl_to_sql = NLToSQL()
-        self.sql_repair = SQLRepair()
+        # Use the optimizer's compiled demos when optimize_nl_to_sql.py has been run
+        self.nl_to_sql = load_optimized(NLToSQL(), NL_TO_SQL_ARTIFACT)
+        self.sql_repair = load_optimized(SQLRepair(), SQL_REPAIR_ARTIFACT)
         self.synthesizer = Synthesizer()
         
+        # format_hint -> answer parser; other hints are resolved (and memoized) on first use
+        self._parsers = {"int": _parse_int, "float": _parse_float, "str": str}
+        
+        # Citable tables: one case-insensitive pass over the SQL, matches mapped to display names
+        self._table_names = {table.lower(): table for table in _CITABLE_TABLES}
+        self._table_re = re.compile(r'\b(' + '|'.join(map(re.escape, self._table_names)) + r')\b', re.I)
+        
         # Build graph
         self.graph = self._build_graph()
     
@@ -48,11 +100,11 @@ class HybridAgent:
         workflow.add_node("synthesizer", self._synthesizer_node)
         workflow.add_node("repair", self._repair_node)
         
-        # Define edges
-        workflow.set_entry_point("router")
-        
-        workflow.add_edge("router", "retriever")
-        workflow.add_edge("retriever", "planner")
+        # Define edges: routing and retrieval only need the question, so run them
+        # in parallel from START and join at the planner
+        workflow.add_edge(START, "router")
+        workflow.add_edge(START, "retriever")
+        workflow.add_edge(["router", "retriever"], "planner")
         
         # Conditional from planner
         workflow.add_conditional_edges(
@@ -81,29 +133,61 @@ class HybridAgent:
         
         return workflow.compile()
     
-    def _route_node(self, state: AgentState) -> AgentState:
-        """Node 1: Route the question."""
+    def _route_node(self, state: AgentState) -> Dict[str, Any]:
+        """Node 1: Route the question (runs in parallel with retrieval)."""
         route = self.router.forward(state["question"])
-        state["route"] = route
-        state["trace"].append(f"Routed to: {route}")
-        return state
+        return {"route": route, "trace": [f"Routed to: {route}"]}
     
-    def _retriever_node(self, state: AgentState) -> AgentState:
-        """Node 2: Retrieve relevant documents."""
-        results = self.retriever.search(state["question"], top_k=3)
-        state["retrieved_docs"] = results
-        state["trace"].append(f"Retrieved {len(results)} docs")
-        return state
+    def _retriever_node(self, state: AgentState) -> Dict[str, Any]:
+        """Node 2: Retrieve relevant documents (runs in parallel with routing)."""
+        results = self.retriever.search(state["question"], top_k=3, query_vec=state.get("precomputed_qvec"))
+        scores = ", ".join(f"{d['score']:.2f}" for d in results)
+        return {"retrieved_docs": results, "trace": [f"Retrieved {len(results)} docs (scores: {scores})"]}
     
-    def _planner_node(self, state: AgentState) -> AgentState:
+    def _planner_node(self, state: AgentState) -> Dict[str, Any]:
         """Node 3: Extract constraints and plan approach."""
+        update: Dict[str, Any] = {"trace": []}
+        docs = state["retrieved_docs"]
+        
+        # SQL-only questions are answered from the schema: drop the docs so they
+        # don't pad the NL-to-SQL/synthesizer prompts or get cited
+        if state["route"] == "sql" and docs:
+            docs = update["retrieved_docs"] = []
+            update["trace"].append("Planner: sql route, skipping doc context")
+        
         # Extract date ranges, categories, KPI formulas from docs
-        doc_context = "\n".join([doc['content'] for doc in state["retrieved_docs"]])
+        doc_context = self._build_doc_context(docs)
         
         # Simple extraction patterns
-        dates = re.findall(r'\d{4}-\d{2}-\d{2}', doc_context)
-        state["trace"].append(f"Planner: Found {len(dates)} dates, route={state['route']}")
-        return state
+        dates = _DATE_RE.findall(doc_context)
+        update["trace"].append(f"Planner: Found {len(dates)} dates, route={state['route']}")
+        return update
+    
+    def _build_doc_context(self, docs: List[Dict], max_chars: int = 1500, with_ids: bool = False) -> str:
+        """Join relevant, de-duplicated chunks (best first) within a character budget."""
+        seen = set()
+        parts = []
+        remaining = max_chars
+        
+        for doc in sorted(docs, key=lambda d: d['score'], reverse=True):
+            if doc['score'] <= self.retriever.min_score:
+                break
+            
+            digest = hashlib.blake2b(doc['content'].encode('utf-8'), digest_size=8).digest()
+            if digest in seen:
+                continue
+            seen.add(digest)
+            
+            text = f"{doc['id']}: {doc['content']}" if with_ids else doc['content']
+            if len(text) >= remaining:
+                if remaining > 0:
+                    parts.append(text[:remaining])
+                break
+            
+            parts.append(text)
+            remaining -= len(text) + 1  # newline separator
+        
+        return "\n".join(parts)
     
     def _should_query_sql(self, state: AgentState) -> str:
         """Decide if we need SQL."""
@@ -111,9 +195,9 @@ class HybridAgent:
             return "sql"
         return "rag_only"
     
-    def _nl_to_sql_node(self, state: AgentState) -> AgentState:
+    def _nl_to_sql_node(self, state: AgentState) -> Dict[str, Any]:
         """Node 4: Generate SQL query."""
-        doc_context = "\n".join([doc['content'] for doc in state["retrieved_docs"]])
+        doc_context = self._build_doc_context(state["retrieved_docs"])
         
         sql = self.nl_to_sql.forward(
             question=state["question"],
@@ -121,25 +205,21 @@ class HybridAgent:
             context=doc_context
         )
         
-        state["sql"] = sql
-        state["trace"].append(f"Generated SQL: {sql[:100]}...")
-        return state
+        return {"sql": sql, "trace": [f"Generated SQL: {sql[:100]}..."]}
     
-    def _executor_node(self, state: AgentState) -> AgentState:
+    def _executor_node(self, state: AgentState) -> Dict[str, Any]:
         """Node 5: Execute SQL query."""
         if not state.get("sql"):
-            state["sql_results"] = {"success": True, "rows": [], "columns": []}
-            return state
+            return {"sql_results": {"success": True, "rows": [], "columns": []}}
         
         result = self.db_tool.execute_query(state["sql"])
-        state["sql_results"] = result
         
         if result["success"]:
-            state["trace"].append(f"SQL success: {len(result['rows'])} rows")
+            message = f"SQL success: {len(result['rows'])} rows"
         else:
-            state["trace"].append(f"SQL error: {result['error']}")
+            message = f"SQL error: {result['error']}"
         
-        return state
+        return {"sql_results": result, "trace": [message]}
     
     def _should_repair(self, state: AgentState) -> str:
         """Decide if repair is needed."""
@@ -151,9 +231,9 @@ class HybridAgent:
         
         return "synthesize"
     
-    def _repair_node(self, state: AgentState) -> AgentState:
+    def _repair_node(self, state: AgentState) -> Dict[str, Any]:
         """Node 7: Repair failed SQL."""
-        state["repair_count"] = state.get("repair_count", 0) + 1
+        repair_count = state.get("repair_count", 0) + 1
         
         fixed_sql = self.sql_repair.forward(
             original_sql=state["sql"],
@@ -161,18 +241,17 @@ class HybridAgent:
             schema=self.schema
         )
         
-        state["sql"] = fixed_sql
-        state["trace"].append(f"Repair attempt {state['repair_count']}: {fixed_sql[:100]}...")
-        return state
+        return {
+            "sql": fixed_sql,
+            "repair_count": repair_count,
+            "trace": [f"Repair attempt {repair_count}: {fixed_sql[:100]}..."]
+        }
     
-    def _synthesizer_node(self, state: AgentState) -> AgentState:
+    def _synthesizer_node(self, state: AgentState) -> Dict[str, Any]:
         """Node 6: Synthesize final answer."""
-        doc_context = "\n".join([
-            f"{doc['id']}: {doc['content']}" 
-            for doc in state["retrieved_docs"]
-        ])
+        doc_context = self._build_doc_context(state["retrieved_docs"], with_ids=True)
         
-        sql_results_str = json.dumps(state["sql_results"]["rows"], indent=2) if state["sql_results"]["success"] else ""
+        sql_results_str = self._format_sql_results(state["sql_results"])
         
         answer_raw, explanation = self.synthesizer.forward(
             question=state["question"],
@@ -190,13 +269,31 @@ class HybridAgent:
         # Calculate confidence
         confidence = self._calculate_confidence(state)
         
-        state["final_answer"] = final_answer
-        state["explanation"] = explanation
-        state["citations"] = citations
-        state["confidence"] = confidence
-        state["trace"].append(f"Synthesized answer: {final_answer}")
+        return {
+            "final_answer": final_answer,
+            "explanation": explanation,
+            "citations": citations,
+            "confidence": confidence,
+            "trace": [f"Synthesized answer: {final_answer}"]
+        }
+    
+    def _format_sql_results(self, sql_results: Dict, max_rows: int = 50) -> str:
+        """Render SQL rows as compact CSV for the LLM (far fewer tokens than indented JSON)."""
+        if not sql_results.get("success"):
+            return ""
+        
+        columns = sql_results["columns"]
+        rows = sql_results["rows"]
+        
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow(columns)
+        writer.writerows([row.get(col) for col in columns] for row in rows[:max_rows])
         
-        return state
+        if len(rows) > max_rows:
+            buf.write(f"...({len(rows) - max_rows} more rows)\n")
+        
+        return buf.getvalue().rstrip("\n")
     
     def _parse_answer(self, answer: str, format_hint: str) -> Any:
         """Parse answer to match format_hint."""
@@ -209,25 +306,22 @@ class HybridAgent:
                 answer = answer[5:]
             answer = answer.strip()
         
+        parser = self._parsers.get(format_hint)
+        if parser is None:
+            # list[...] and {...} hints are JSON; anything else stays a string
+            parser = _json_loads if ("list[" in format_hint or "{" in format_hint) else str
+            self._parsers[format_hint] = parser
+        
+        if parser is str:
+            return answer
+        
         try:
-            if format_hint == "int":
-                return int(re.search(r'\d+', answer).group())
-            elif format_hint == "float":
-                match = re.search(r'[\d.]+', answer)
-                return round(float(match.group()), 2) if match else 0.0
-            elif "list[" in format_hint:
-                # Try to parse as JSON
-                return json.loads(answer)
-            elif "{" in format_hint:
-                # Parse as dict
-                return json.loads(answer)
-            else:
-                return answer
-        except:
+            return parser(answer)
+        except (ValueError, AttributeError):  # JSONDecodeError is a ValueError; AttributeError = no match
             # Fallback
             try:
-                return json.loads(answer)
-            except:
+                return _json_loads(answer)
+            except ValueError:
                 return answer
     
     def _extract_citations(self, state: AgentState) -> List[str]:
@@ -236,18 +330,16 @@ class HybridAgent:
         
         # Add doc chunks
         for doc in state["retrieved_docs"]:
-            if doc['score'] > 0.1:  # Only cite relevant docs
+            if doc['score'] > self.retriever.min_score:  # Only cite relevant docs
                 citations.append(doc['id'])
         
         # Add SQL tables
         if state["sql_results"]["success"] and state.get("sql"):
-            sql = state["sql"].upper()
-            tables = ["Orders", "Order Details", "Products", "Customers", "Categories", "Suppliers"]
-            for table in tables:
-                if table.upper() in sql or f'"{table.upper()}"' in sql:
-                    citations.append(table)
+            for match in self._table_re.finditer(state["sql"]):
+                citations.append(self._table_names[match.group(1).lower()])
         
-        return list(set(citations))
+        # Dedupe keeping first-seen order (docs by retrieval score, then tables)
+        return list(dict.fromkeys(citations))
     
     def _calculate_confidence(self, state: AgentState) -> float:
         """Calculate confidence score."""
@@ -257,25 +349,32 @@ class HybridAgent:
         if state["sql_results"]["success"] and state["sql_results"]["rows"]:
             confidence += 0.3
         
-        # Boost for good retrieval scores
-        if state["retrieved_docs"]:
-            avg_score = sum(d['score'] for d in state["retrieved_docs"]) / len(state["retrieved_docs"])
-            confidence += avg_score * 0.2
+        # Boost for good retrieval scores (off-topic chunks don't count)
+        relevant = [d['score'] for d in state["retrieved_docs"] if d['score'] > self.retriever.min_score]
+        if relevant:
+            confidence += sum(relevant) / len(relevant) * 0.2
         
         # Penalize repairs
         confidence -= state.get("repair_count", 0) * 0.1
         
         return round(max(0.0, min(1.0, confidence)), 2)
     
-    def run(self, question: str, format_hint: str) -> Dict[str, Any]:
-        """Run the agent on a question."""
+    def run(self, question: str, format_hint: str, query_vec: Optional[np.ndarray] = None) -> Dict[str, Any]:
+        """Run the agent on a question (query_vec: optional precomputed retriever embedding)."""
+        if self.cache:
+            cached = self.cache.lookup(question, format_hint, query_vec)
+            if cached is not None:
+                return cached
+        
         initial_state = {
             "question": question,
             "format_hint": format_hint,
+            "precomputed_qvec": query_vec,
             "route": "",
             "retrieved_docs": [],
             "sql": "",
-            "sql_results": {},
+            # rag-only questions never reach the executor; citations/confidence still read this
+            "sql_results": {"success": False, "rows": [], "columns": [], "error": None},
             "final_answer": None,
             "explanation": "",
             "citations": [],
@@ -286,11 +385,45 @@ class HybridAgent:
         
         final_state = self.graph.invoke(initial_state)
         
-        return {
+        result = {
             "final_answer": final_state["final_answer"],
             "sql": final_state.get("sql", ""),
             "confidence": final_state["confidence"],
             "explanation": final_state["explanation"],
             "citations": final_state["citations"],
             "trace": final_state["trace"]
-        }
\ No newline at end of file
+        }
+        
+        if self.cache and self._is_cacheable(final_state):
+            self.cache.add(question, format_hint, result, query_vec)
+        
+        return result
+    
+    def _cache_version(self) -> str:
+        """Hash of the LM config, prompt/graph code, compiled artifacts, docs index and DB."""
+        lm = dspy.settings.lm
+        parts = [
+            repr(getattr(lm, "model", None)),
+            repr(sorted(getattr(lm, "kwargs", {}).items())),
+            inspect.getsource(agent.dspy_signatures),
+            inspect.getsource(inspect.getmodule(HybridAgent)),
+            self.retriever.fingerprint or "",
+            repr(self.retriever.min_score),
+            os.path.abspath(self.db_path),
+        ]
+        for path in (NL_TO_SQL_ARTIFACT, SQL_REPAIR_ARTIFACT, self.db_path):
+            if os.path.exists(path):
+                stat = os.stat(path)
+                parts.append(f"{path}:{stat.st_size}:{stat.st_mtime_ns}")
+        return hashlib.sha256("\0".join(parts).encode('utf-8')).hexdigest()
+    
+    def _is_cacheable(self, final_state: Dict[str, Any]) -> bool:
+        """Only keep answers worth replaying: SQL (if any) succeeded and confidence isn't low."""
+        if final_state.get("sql") and not final_state["sql_results"].get("success"):
+            return False
+        return final_state["final_answer"] is not None and final_state["confidence"] >= _CACHE_MIN_CONFIDENCE
+    
+    def save_cache(self):
+        """Persist the semantic cache if it was given a path."""
+        if self.cache:
+            self.cache.save()
@@ -0,0 +1,137 @@
+import copy
+import os
+import pickle
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+_NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+# Quoted strings and capitalised tokens: categories, campaigns, customer/product names
+_ENTITY_RE = re.compile(r"""(?<!\w)'([^']+)'(?!\w)|"([^"]+)"|\b([A-Z][\w&/-]*)""")
+_SENTENCE_END = ("", ".", "?", "!")
+
+def _entities(question: str) -> Tuple[str, ...]:
+    """Lowercased named entities, skipping words capitalised only because they start a sentence."""
+    entities = set()
+    for match in _ENTITY_RE.finditer(question):
+        quoted = match.group(1) or match.group(2)
+        if quoted:
+            entities.add(quoted.lower())
+        elif question[:match.start()].rstrip()[-1:] not in _SENTENCE_END:
+            entities.add(match.group(3).lower())
+    return tuple(sorted(entities))
+
+class SemanticCache:
+    """Question -> agent result cache with exact and cosine-similarity lookup.
+
+    Entries are only compared within the same format_hint, numbers and named
+    entities (quoted strings, capitalised words) in the question, so "June 1997"
+    never matches "July 1998" and 'Beverages' never matches 'Condiments'.
+    """
+
+    def __init__(self, encode: Callable[[str], np.ndarray], threshold: float = 0.95,
+                 path: Optional[str] = None, version: str = ""):
+        self.encode = encode
+        self.threshold = threshold
+        self.path = path
+        # Identifies everything that shapes an answer; a persisted cache with a different version is discarded
+        self.version = version
+        self._exact: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._cache_vecs: Dict[Tuple, np.ndarray] = {}
+        self._cache_results: Dict[Tuple, List[Dict[str, Any]]] = {}
+        self._entries: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            self.load(path)
+
+    @staticmethod
+    def _normalize(question: str) -> str:
+        return " ".join(question.lower().split())
+
+    def _bucket(self, question: str, format_hint: str) -> Tuple:
+        return (format_hint, tuple(_NUMBER_RE.findall(question)), _entities(question))
+
+    def _unit_vector(self, question: str, vec: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        if vec is None:
+            vec = self.encode(question)
+        vec = np.asarray(vec, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else None
+
+    def lookup(self, question: str, format_hint: str,
+               vec: Optional[np.ndarray] = None) -> Optional[Dict[str, Any]]:
+        """Return a cached result for this (or a near-identical) question, or None."""
+        with self._lock:
+            # Exact match skips embedding entirely
+            hit = self._exact.get((self._normalize(question), format_hint))
+            if hit is not None:
+                return self._copy_hit(hit, "Cache hit: exact")
+
+            bucket = self._bucket(question, format_hint)
+            vecs = self._cache_vecs.get(bucket)
+            if vecs is None:
+                return None
+
+            vec = self._unit_vector(question, vec)
+            if vec is None:
+                return None
+
+            sims = vecs @ vec
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                return None
+
+            hit = self._cache_results[bucket][best]
+            return self._copy_hit(hit, f"Cache hit: similarity {sims[best]:.3f}")
+
+    @staticmethod
+    def _copy_hit(hit: Dict[str, Any], note: str) -> Dict[str, Any]:
+        # Deep copy so callers can't mutate the cached citations/trace lists
+        hit = copy.deepcopy(hit)
+        hit["trace"].append(note)
+        return hit
+
+    def add(self, question: str, format_hint: str, result: Dict[str, Any],
+            vec: Optional[np.ndarray] = None):
+        """Store the result of a completed agent run."""
+        with self._lock:
+            self._add(question, format_hint, result, vec)
+
+    def _add(self, question: str, format_hint: str, result: Dict[str, Any],
+             vec: Optional[np.ndarray] = None):
+        result = copy.deepcopy(result)  # detach from the caller's lists
+        self._exact[(self._normalize(question), format_hint)] = result
+        self._entries.append({"question": question, "format_hint": format_hint, "result": result})
+
+        vec = self._unit_vector(question, vec)
+        if vec is None:
+            return
+
+        bucket = self._bucket(question, format_hint)
+        if bucket in self._cache_vecs:
+            self._cache_vecs[bucket] = np.vstack([self._cache_vecs[bucket], vec])
+            self._cache_results[bucket].append(result)
+        else:
+            self._cache_vecs[bucket] = vec[np.newaxis, :]
+            self._cache_results[bucket] = [result]
+
+    def save(self, path: Optional[str] = None):
+        """Persist entries to disk; vectors are recomputed on load."""
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            with open(path, 'wb') as f:
+                pickle.dump({"version": self.version, "entries": self._entries}, f)
+
+    def load(self, path: str):
+        """Load entries saved by save() for the same version, re-encoding with the current encoder."""
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        if not isinstance(data, dict) or data.get("version") != self.version:
+            return  # stale: model, prompts, artifacts or DB changed since it was written
+        with self._lock:
+            for entry in data["entries"]:
+                self._add(entry["question"], entry["format_hint"], entry["result"])
@@ -1,37 +1,65 @@
 import sqlite3
+import threading
+from pathlib import Path
 from typing import Dict, List, Any, Optional
 
+# Read-side tuning applied to every connection
+_PRAGMAS = (
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",  # 256MB memory-mapped I/O
+    "PRAGMA cache_size=-65536",    # 64MB page cache
+    "PRAGMA query_only=ON",
+)
+
 class SQLiteTool:
     def __init__(self, db_path: str):
         self.db_path = db_path
-        self.conn = sqlite3.connect(db_path)
-        self.conn.row_factory = sqlite3.Row
+        # Read-only URI: no write locks, and a missing file errors instead of creating an empty DB
+        self._uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+        # One connection per thread so the batch runner's workers never share one
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._schema_cache: Optional[str] = None
+        self.conn  # open eagerly so a bad path fails at construction
+    
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Connection owned by the calling thread, opened on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Larger prepared-statement cache for repair retries and repeated query shapes
+            conn = sqlite3.connect(self._uri, uri=True, isolation_level=None, check_same_thread=False,
+                                   cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            for pragma in _PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
     
     def get_schema(self) -> str:
-        """Return schema information for all tables."""
-        cursor = self.conn.cursor()
-        
-        # Get all tables
-        cursor.execute("""
-            SELECT name FROM sqlite_master 
-            WHERE type='table' AND name NOT LIKE 'sqlite_%'
-            ORDER BY name
-        """)
-        tables = [row[0] for row in cursor.fetchall()]
-        
-        schema_parts = []
-        for table in tables:
-            # Get table info
-            cursor.execute(f"PRAGMA table_info([{table}])")
-            columns = cursor.fetchall()
+        """Return schema information for all tables (computed once, schema is static)."""
+        if self._schema_cache is None:
+            cursor = self.conn.cursor()
+            
+            # All tables and their columns in one round-trip
+            cursor.execute("""
+                SELECT m.name, p.name, p.type
+                FROM sqlite_master m JOIN pragma_table_info(m.name) p
+                WHERE m.type='table' AND m.name NOT LIKE 'sqlite_%'
+                ORDER BY m.name, p.cid
+            """)
             
-            col_defs = []
-            for col in columns:
-                col_defs.append(f"  {col[1]} {col[2]}")
+            tables: Dict[str, List[str]] = {}
+            for table, col_name, col_type in cursor.fetchall():
+                tables.setdefault(table, []).append(f"  {col_name} {col_type}")
             
-            schema_parts.append(f"{table}(\n" + ",\n".join(col_defs) + "\n)")
+            schema_parts = [f"{table}(\n" + ",\n".join(col_defs) + "\n)" for table, col_defs in tables.items()]
+            self._schema_cache = "\n\n".join(schema_parts)
         
-        return "\n\n".join(schema_parts)
+        return self._schema_cache
     
     def execute_query(self, sql: str) -> Dict[str, Any]:
         """Execute SQL and return results with columns and rows."""
@@ -43,10 +71,8 @@ class SQLiteTool:
             # Get column names
             columns = [desc[0] for desc in cursor.description] if cursor.description else []
             
-            # Convert rows to list of dicts
-            result_rows = []
-            for row in rows:
-                result_rows.append(dict(zip(columns, row)))
+            # Rows are sqlite3.Row mappings already
+            result_rows = [dict(row) for row in rows]
             
             return {
                 "success": True,
@@ -63,4 +89,8 @@ class SQLiteTool:
             }
     
     def close(self):
-        self.conn.close()
\ No newline at end of file
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
\ No newline at end of file
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
-import dspy
 from rich.console import Console
 from rich.prompt import Prompt
+from agent.dspy_signatures import configure_lm
 from agent.graph_hybrid import HybridAgent
 import json
 import time
@@ -13,13 +13,7 @@ def main():
     
     # Configure DSPy
     console.print("[yellow]Initializing (this may take a moment)...[/yellow]")
-    lm = dspy.LM(
-        model='ollama/phi3.5:3.8b-mini-instruct-q4_K_M',
-        api_base='http://localhost:11434',
-        max_tokens=300,
-        temperature=0.0
-    )
-    dspy.configure(lm=lm)
+    configure_lm()
     
     # Initialize agent
     agent = HybridAgent(
@@ -4,9 +4,11 @@ DSPy optimization script for NL→SQL module.
 Run this to train and evaluate the optimized SQL generator.
 """
 
+import os
 import dspy
 from dspy.teleprompt import BootstrapFewShot
-from agent.dspy_signatures import NLToSQL
+from agent.dspy_signatures import (NLToSQL, SQLRepair, configure_lm,
+                                   NL_TO_SQL_ARTIFACT, SQL_REPAIR_ARTIFACT)
 from agent.tools.sqlite_tool import SQLiteTool
 
 # Training examples for SQL generation
@@ -53,6 +55,55 @@ TRAIN_EXAMPLES = [
     }
 ]
 
+# Few-shot demos per compiled module; each adds ~115-175 prompt tokens even with the
+# schema stripped (see strip_demo_schema), and every NL->SQL/repair call pays for them
+MAX_DEMOS = 2
+
+# Common mistakes used to derive SQL repair training data from TRAIN_EXAMPLES
+SQL_CORRUPTIONS = [
+    ('"Order Details"', 'Order Details'),   # unquoted table name with a space
+    ('ProductName', 'Product_Name'),        # wrong column name
+    ('CategoryName', 'Category'),
+    ('OrderDate', 'Date'),
+    (' GROUP BY ', ' GROUP '),              # broken keyword
+]
+
+def build_repair_examples(db_tool, schema):
+    """Break known-good SQL in realistic ways and keep the variants SQLite rejects."""
+    examples = []
+    for ex in TRAIN_EXAMPLES:
+        for bad, replacement in SQL_CORRUPTIONS:
+            if bad not in ex["sql"]:
+                continue
+            broken_sql = ex["sql"].replace(bad, replacement)
+            result = db_tool.execute_query(broken_sql)
+            if not result["success"]:
+                examples.append(
+                    dspy.Example(schema=schema, original_sql=broken_sql, error=result["error"], fixed_sql=ex["sql"])
+                    .with_inputs("schema", "original_sql", "error")
+                )
+    return examples
+
+def _pred_sql(pred, field):
+    """NLToSQL/SQLRepair.forward return the SQL string; tolerate a Prediction too."""
+    return pred if isinstance(pred, str) else getattr(pred, field, "")
+
+def sql_metric(example, pred, trace=None):
+    """1.0 if the generated SQL looks like a SELECT query."""
+    return 1.0 if "SELECT" in _pred_sql(pred, "sql").upper() else 0.0
+
+def make_repair_metric(db_tool):
+    """1.0 if the repaired SQL executes against the database."""
+    def repair_metric(example, pred, trace=None):
+        return 1.0 if db_tool.execute_query(_pred_sql(pred, "fixed_sql"))["success"] else 0.0
+    return repair_metric
+
+def strip_demo_schema(module):
+    """Drop the schema from compiled demos; the live input already carries it once per prompt."""
+    for _, predictor in module.named_predictors():
+        predictor.demos = [demo.without("schema") for demo in predictor.demos]
+    return module
+
 def evaluate_sql_module(module, db_tool, schema, examples):
     """Evaluate SQL generation success rate."""
     valid_count = 0
@@ -87,14 +138,8 @@ def main():
     print("DSPy NL→SQL Optimization")
     print("=" * 50)
     
-    # Configure DSPy with Ollama (correct API)
-    lm = dspy.LM(
-        model='ollama/phi3.5:3.8b-mini-instruct-q4_K_M',
-        api_base='http://localhost:11434',
-        max_tokens=1000,
-        temperature=0.1
-    )
-    dspy.configure(lm=lm)
+    # Configure DSPy with Ollama (same endpoint the agent runs on)
+    configure_lm(max_tokens=1000, temperature=0.1)
     
     # Load DB schema
     db_tool = SQLiteTool("data/northwind.sqlite")
@@ -124,9 +169,9 @@ def main():
     
     # Configure optimizer
     optimizer = BootstrapFewShot(
-        metric=lambda example, pred, trace: 1.0 if "SELECT" in pred.sql.upper() else 0.0,
-        max_bootstrapped_demos=4,
-        max_labeled_demos=4
+        metric=sql_metric,
+        max_bootstrapped_demos=MAX_DEMOS,
+        max_labeled_demos=MAX_DEMOS
     )
     
     # Compile optimized module
@@ -137,6 +182,11 @@ def main():
         print("   Continuing with baseline for demo purposes...")
         optimized = baseline
     
+    if optimized is not baseline:
+        os.makedirs(os.path.dirname(NL_TO_SQL_ARTIFACT), exist_ok=True)
+        strip_demo_schema(optimized).save(NL_TO_SQL_ARTIFACT)
+        print(f"   Saved compiled module to {NL_TO_SQL_ARTIFACT}")
+    
     # Evaluate optimized version
     print("\n3. Evaluating optimized NL→SQL module...")
     optimized_metrics = evaluate_sql_module(optimized, db_tool, schema, eval_examples)
@@ -157,11 +207,30 @@ def main():
     print(f"  After:  {optimized_metrics['exec_success_rate']:.1%}")
     print(f"  Delta:  +{(optimized_metrics['exec_success_rate'] - baseline_metrics['exec_success_rate']):.1%}")
     
+    # Compile the SQL repair module on deliberately broken queries
+    print("\n5. Optimizing SQL repair module...")
+    repair_set = build_repair_examples(db_tool, schema)
+    print(f"   {len(repair_set)} repair examples")
+    
+    repair_optimizer = BootstrapFewShot(
+        metric=make_repair_metric(db_tool),
+        max_bootstrapped_demos=MAX_DEMOS,
+        max_labeled_demos=MAX_DEMOS
+    )
+    
+    try:
+        optimized_repair = repair_optimizer.compile(SQLRepair(), trainset=repair_set)
+        os.makedirs(os.path.dirname(SQL_REPAIR_ARTIFACT), exist_ok=True)
+        strip_demo_schema(optimized_repair).save(SQL_REPAIR_ARTIFACT)
+        print(f"   Saved compiled module to {SQL_REPAIR_ARTIFACT}")
+    except Exception as e:
+        print(f"   Note: Repair optimization encountered issue: {e}")
+    
     db_tool.close()
     
     print("\n✓ Optimization complete!")
     print("  The optimized module improves SQL generation by learning from examples.")
-    print("  In production, save the optimized module with: optimized.save('nl_to_sql_optimized')")
+    print("  HybridAgent loads the saved modules from artifacts/ automatically on startup.")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
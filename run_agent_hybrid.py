@@ -1,36 +1,73 @@
 #!/usr/bin/env python3
+import os
+import atexit
 import click
 import json
-import dspy
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from rich.console import Console
 from rich.progress import track
+from agent.dspy_signatures import configure_lm
 from agent.graph_hybrid import HybridAgent
 
 console = Console()
 
+def _answer(agent: HybridAgent, q: dict, query_vec=None):
+    """Run one question; returns (output, elapsed, error) and never raises."""
+    start_time = time.time()
+    
+    try:
+        result = agent.run(q['question'], q.get('format_hint', 'str'), query_vec=query_vec)
+        
+        output = {
+            "id": q['id'],
+            "final_answer": result['final_answer'],
+            "sql": result.get('sql', ''),
+            "confidence": result['confidence'],
+            "explanation": result['explanation'],
+            "citations": result['citations']
+        }
+        return output, time.time() - start_time, None
+    
+    except Exception as e:
+        # Save error case too
+        output = {
+            "id": q['id'],
+            "final_answer": None,
+            "sql": "",
+            "confidence": 0.0,
+            "explanation": f"Error: {str(e)}",
+            "citations": []
+        }
+        return output, time.time() - start_time, str(e)
+
 @click.command()
 @click.option('--batch', required=True, help='Path to input JSONL file')
 @click.option('--out', required=True, help='Path to output JSONL file')
-def main(batch: str, out: str):
+@click.option('--workers', type=int, default=lambda: int(os.environ.get('OLLAMA_NUM_PARALLEL', 4)),
+              show_default='$OLLAMA_NUM_PARALLEL or 4',
+              help='Questions processed concurrently (match Ollama num_parallel)')
+@click.option('--cache/--no-cache', default=True, show_default=True,
+              help='Reuse answers for repeated or near-identical questions within this run')
+@click.option('--cache-path', default=None,
+              help='Persist the answer cache here (e.g. data/semcache.pkl) and reuse it across runs')
+def main(batch: str, out: str, workers: int, cache: bool, cache_path: str):
     """Run the hybrid retail analytics agent on a batch of questions."""
     
     console.print("[bold blue]Initializing Retail Analytics Copilot...[/bold blue]")
     
     # Configure DSPy with Ollama
-    lm = dspy.LM(
-        model='ollama/phi3.5:3.8b-mini-instruct-q4_K_M',
-        api_base='http://localhost:11434',
-        max_tokens=300,
-        temperature=0.0
-    )
-    dspy.configure(lm=lm)
+    configure_lm()
     
     # Initialize agent
     agent = HybridAgent(
         db_path="data/northwind.sqlite",
-        docs_path="docs"
+        docs_path="docs",
+        use_cache=cache,
+        cache_path=cache_path,
+        index_path="data/docs_hnsw.bin"
     )
+    atexit.register(agent.save_cache)
     
     console.print("[green]✓[/green] Agent initialized")
     
@@ -42,64 +79,70 @@ def main(batch: str, out: str):
             if line:
                 questions.append(json.loads(line))
     
-    console.print(f"[bold]Processing {len(questions)} questions...[/bold]\n")
+    # All questions are known up front: embed them in one batch for retrieval
+    query_vecs = agent.retriever.encode_queries([q['question'] for q in questions]) if questions else []
+    
+    console.print(f"[bold]Processing {len(questions)} questions with {workers} workers...[/bold]\n")
+    
+    # One line-buffered handle for the whole run: each result is flushed as its
+    # line completes, and atexit closes it even if the run is cut short
+    f_out = open(out, 'w', buffering=1)
+    atexit.register(f_out.close)
     
-    # Clear output file at start
-    with open(out, 'w') as f:
-        pass  # Create empty file
+    # Questions are independent, so fan them out across a thread pool and
+    # let the DSPy LM calls overlap; size --workers to Ollama's num_parallel.
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = {executor.submit(_answer, agent, q, qvec): q for q, qvec in zip(questions, query_vecs)}
     
-    # Process each question
-    for i, q in enumerate(questions, 1):
+    def _report(i: int, future):
+        q = futures.pop(future)
+        output, elapsed, error = future.result()
+        
         console.print(f"\n[bold cyan]Question {i}/{len(questions)}:[/bold cyan]")
         console.print(f"  {q['question'][:100]}...")
         
-        start_time = time.time()
+        # SAVE IMMEDIATELY AFTER EACH QUESTION (only this thread writes)
+        f_out.write(json.dumps(output) + '\n')
+        
+        if error:
+            console.print(f"[red]✗[/red] Error after {elapsed:.1f}s: {error}")
+            return
         
+        console.print(f"[green]✓[/green] Answer: {output['final_answer']}")
+        console.print(f"  Time: {elapsed:.1f}s")
+        console.print(f"  Confidence: {output['confidence']}")
+        console.print(f"  Citations: {', '.join(output['citations'][:3])}...")
+        console.print(f"[dim]  Saved to {out}[/dim]")
+    
+    done = 0
+    try:
+        for future in as_completed(list(futures)):
+            done += 1
+            _report(done, future)
+    
+    except KeyboardInterrupt:
+        # Queued questions are dropped; running ones can't be killed, so wait
+        # for them and keep their results. A second Ctrl-C quits immediately.
+        executor.shutdown(wait=False, cancel_futures=True)
+        running = [future for future in futures if not future.cancelled()]
+        console.print(f"\n[yellow]⚠ Interrupted by user: waiting for {len(running)} in-flight "
+                      f"question(s) to finish (Ctrl-C again to quit without them)[/yellow]")
         try:
-            result = agent.run(q['question'], q.get('format_hint', 'str'))
-            
-            elapsed = time.time() - start_time
-            
-            output = {
-                "id": q['id'],
-                "final_answer": result['final_answer'],
-                "sql": result.get('sql', ''),
-                "confidence": result['confidence'],
-                "explanation": result['explanation'],
-                "citations": result['citations']
-            }
-            
-            # SAVE IMMEDIATELY AFTER EACH QUESTION
-            with open(out, 'a') as f:  # 'a' for append mode
-                f.write(json.dumps(output) + '\n')
-            
-            console.print(f"[green]✓[/green] Answer: {result['final_answer']}")
-            console.print(f"  Time: {elapsed:.1f}s")
-            console.print(f"  Confidence: {result['confidence']}")
-            console.print(f"  Citations: {', '.join(result['citations'][:3])}...")
-            console.print(f"[dim]  Saved to {out}[/dim]")
-            
+            for future in as_completed(running):
+                done += 1
+                _report(done, future)
         except KeyboardInterrupt:
-            console.print(f"\n[yellow]⚠ Interrupted by user[/yellow]")
-            console.print(f"[green]✓ Partial results saved to {out}[/green]")
-            break
-            
-        except Exception as e:
-            elapsed = time.time() - start_time
-            console.print(f"[red]✗[/red] Error after {elapsed:.1f}s: {str(e)}")
-            
-            # Save error case too
-            output = {
-                "id": q['id'],
-                "final_answer": None,
-                "sql": "",
-                "confidence": 0.0,
-                "explanation": f"Error: {str(e)}",
-                "citations": []
-            }
-            
-            with open(out, 'a') as f:
-                f.write(json.dumps(output) + '\n')
+            f_out.close()
+            agent.save_cache()
+            console.print(f"\n[yellow]⚠ Aborted; in-flight questions discarded[/yellow]")
+            os._exit(130)  # worker threads are joined at exit, so skip the normal shutdown
+        console.print(f"[green]✓ Partial results saved to {out}[/green]")
+        return
+    
+    finally:
+        f_out.close()
+    
+    executor.shutdown()
     
     console.print(f"\n[bold green]✓ All results saved to {out}[/bold green]")
 
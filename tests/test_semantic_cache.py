@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+from agent.semantic_cache import SemanticCache
+
+BEVERAGES_Q = "Total revenue from the 'Beverages' category during 'Summer Beverages 1997'. Return a float."
+
+def _encode(question: str) -> np.ndarray:
+    """Bag-of-words over a tiny vocabulary; enough to make paraphrases similar."""
+    vocab = ["total", "revenue", "category", "during", "return", "float", "beverages", "condiments", "summer", "winter"]
+    words = question.lower().replace("'", " ").replace(".", " ").split()
+    return np.array([words.count(w) for w in vocab], dtype=np.float32)
+
+def _result(answer, citations=None):
+    return {"final_answer": answer, "sql": "", "confidence": 0.9, "explanation": "",
+            "citations": citations if citations is not None else ["Orders"], "trace": ["Synthesized answer"]}
+
+@pytest.fixture
+def cache():
+    return SemanticCache(_encode, threshold=0.95)
+
+def test_exact_hit_ignores_case_and_whitespace(cache):
+    cache.add(BEVERAGES_Q, "float", _result(1.5))
+    hit = cache.lookup("  " + BEVERAGES_Q.upper(), "float")
+    assert hit["final_answer"] == 1.5
+    assert hit["trace"][-1] == "Cache hit: exact"
+
+def test_similar_question_hits(cache):
+    cache.add(BEVERAGES_Q, "float", _result(1.5))
+    hit = cache.lookup("What was the total revenue from the 'Beverages' category during 'Summer Beverages 1997'? Return a float.", "float")
+    assert hit["final_answer"] == 1.5
+    assert hit["trace"][-1].startswith("Cache hit: similarity")
+
+def test_miss_on_different_format_hint(cache):
+    cache.add(BEVERAGES_Q, "float", _result(1.5))
+    assert cache.lookup(BEVERAGES_Q, "int") is None
+
+def test_miss_on_different_numbers(cache):
+    cache.add(BEVERAGES_Q, "float", _result(1.5))
+    assert cache.lookup(BEVERAGES_Q.replace("1997", "1998"), "float") is None
+
+@pytest.mark.parametrize("old, new", [
+    ("'Beverages' category", "'Condiments' category"),
+    ("'Summer Beverages 1997'", "'Winter Beverages 1997'"),
+])
+def test_miss_on_different_entity(old, new):
+    # A constant encoder makes every question identical in vector space: only the bucket can tell them apart
+    cache = SemanticCache(lambda q: np.ones(4, dtype=np.float32), threshold=0.95)
+    cache.add(BEVERAGES_Q, "float", _result(1.5))
+    assert cache.lookup(BEVERAGES_Q.replace(old, new), "float") is None
+
+def test_miss_below_threshold(cache):
+    cache.add(BEVERAGES_Q, "float", _result(1.5))
+    assert cache.lookup("Revenue during 'Summer Beverages 1997' for the 'Beverages' category.", "float") is None
+
+def test_hits_do_not_share_state_with_cache(cache):
+    result = _result(1.5)
+    cache.add(BEVERAGES_Q, "float", result)
+    result["citations"].append("added-after-add")
+
+    hit = cache.lookup(BEVERAGES_Q, "float")
+    hit["citations"].append("added-by-caller")
+
+    again = cache.lookup(BEVERAGES_Q, "float")
+    assert again["citations"] == ["Orders"]
+    assert again["trace"] == ["Synthesized answer", "Cache hit: exact"]
+
+def test_save_and_load_same_version(tmp_path):
+    path = str(tmp_path / "cache.pkl")
+    cache = SemanticCache(_encode, path=path, version="v1")
+    cache.add(BEVERAGES_Q, "float", _result(1.5))
+    cache.save()
+
+    reloaded = SemanticCache(_encode, path=path, version="v1")
+    assert reloaded.lookup(BEVERAGES_Q, "float")["final_answer"] == 1.5
+    assert reloaded.lookup("What was the total revenue from the 'Beverages' category during 'Summer Beverages 1997'? Return a float.", "float") is not None
+
+def test_load_discards_other_version(tmp_path):
+    path = str(tmp_path / "cache.pkl")
+    cache = SemanticCache(_encode, path=path, version="v1")
+    cache.add(BEVERAGES_Q, "float", _result(1.5))
+    cache.save()
+
+    assert SemanticCache(_encode, path=path, version="v2").lookup(BEVERAGES_Q, "float") is None
+
+def test_save_without_path_is_noop(cache, tmp_path):
+    cache.add(BEVERAGES_Q, "float", _result(1.5))
+    cache.save()
+    assert list(tmp_path.iterdir()) == []